@@ -198,14 +198,11 @@ def plot_distances(distances):
   rcParams["font.family"] = "monospace"
   cmap = plt.cm.Dark2
 
-  indice = np.arange(0, len(distances), 1)
-  plt.scatter(
-    indice,
-    distances,
-    c=[
-      cmap(i) for i in np.linspace(0, 1, DATASET_IMAGE_NUM * DATASET_IMAGE_NUM)
-    ],
-  )
+  # hand matplotlib one contiguous float32 buffer, no hidden cast-copies
+  distances = np.ascontiguousarray(distances, dtype=np.float32)
+  indice = np.arange(distances.size)
+  colors = np.linspace(0.0, 1.0, distances.size, dtype=np.float32)
+  plt.scatter(indice, distances, c=colors, cmap=cmap)
   plt.axhline(y=THRESHOLD[BUDGET_LEVEL][ATTACK_METHOD], color=cmap(0))
 
   plt.ylabel("Distance")
@@ -183,6 +183,9 @@ def main():
   # use GPU if available
   if torch.cuda.is_available():
     model = model.cuda()
+    # only 213 * 213 adversaries and their ×0.5 / ×2 rescales are validated,
+    # so let cuDNN benchmark the fastest convolutions once per shape
+    torch.backends.cudnn.benchmark = True
 
   fmodel = foolbox.models.PyTorchModel(
     model,
@@ -191,7 +194,9 @@ def main():
     preprocessing=preprocessing,
   )
 
-  advs = np.load(ADV_SAVE_PATH)
+  # map adversaries instead of reading the whole file upfront,
+  # pages are only faulted in once a batch is validated or resized
+  advs = np.load(ADV_SAVE_PATH, mmap_mode="r")
 
   # * TASK 1/3: validate original adversaries
   control_group_acc = utils.validate(
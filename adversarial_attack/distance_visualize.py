@@ -36,10 +36,11 @@ def plot_distances(distances, save_plot=False):
   rcParams["font.family"] = "monospace"
   cmap = plt.cm.Dark2
 
-  indice = np.arange(0, len(distances), 1)
-  plt.scatter(
-    indice, distances, c=[cmap(i) for i in np.linspace(0, 1, len(distances))],
-  )
+  # hand matplotlib one contiguous float32 buffer, no hidden cast-copies
+  distances = np.ascontiguousarray(distances, dtype=np.float32)
+  indice = np.arange(distances.size)
+  colors = np.linspace(0.0, 1.0, distances.size, dtype=np.float32)
+  plt.scatter(indice, distances, c=colors, cmap=cmap)
   plt.axhline(y=THRESHOLD[BUDGET_LEVEL], color=cmap(0))
 
   plt.ylabel("Distance")
@@ -66,14 +67,9 @@ def plot_distances(distances, save_plot=False):
 
 def main():
   """ Read file and plot! """
-  dist_str = []
-
-  # Read HSJA distance file
-  with open(DIST_FILE_PATH, "r") as f:
-    for line in f.readlines():
-      dist_str.append(line)
 
-  dists = np.array(dist_str).astype(np.float32)
+  # Read HSJA distance file (one distance per line)
+  dists = np.loadtxt(DIST_FILE_PATH, dtype=np.float32, ndmin=1)
   plot_distances(dists, save_plot=SAVE_DIST_PLOT)
 
 
@@ -9,7 +9,11 @@ Functions:
   * scale_adv(): Scales adversaries with OpenCV
 """
 
+import inspect
+import json
 import os
+import subprocess
+import threading
 
 import cv2
 import numpy as np
@@ -19,6 +23,33 @@ import torchvision
 import torchvision.transforms as transforms
 from tqdm.auto import tqdm
 
+try:
+  # tensor based transforms, ToDtype(scale=) needs torchvision 0.16+
+  from torchvision.transforms import v2
+
+  if "scale" not in inspect.signature(v2.ToDtype).parameters:
+    v2 = None
+except ImportError:
+  v2 = None
+
+# no autograd bookkeeping for validation, inference_mode() needs PyTorch 1.9+
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+# persistent_workers / prefetch_factor were added to DataLoader in PyTorch 1.7
+_LOADER_HAS_PERSISTENT_WORKERS = (
+  "persistent_workers"
+  in inspect.signature(torch.utils.data.DataLoader.__init__).parameters
+)
+
+# OpenCV interpolation flags supported by scale_adv()
+_INTERPOLATION_METHODS = {
+  "INTER_NEAREST": cv2.INTER_NEAREST,
+  "INTER_LINEAR": cv2.INTER_LINEAR,
+  "INTER_AREA": cv2.INTER_AREA,
+  "INTER_CUBIC": cv2.INTER_CUBIC,
+  "INTER_LANCZOS4": cv2.INTER_LANCZOS4,
+}
+
 
 def load_trained_model(model_name=None, model_path="", class_num=10):
   """ Load trained model from .pth file.
@@ -28,58 +59,140 @@ def load_trained_model(model_name=None, model_path="", class_num=10):
     * "vgg": vgg11
     * "inception": inception v3
     * "mobilenet": mobilenet v2
+
+  `model_path` is required, ImageNet weights are never used as a fallback.
   """
 
+  # every parameter comes from the fine-tuned state dict, so ImageNet weights
+  # are never downloaded, and a missing checkpoint must not fall back to them
+  if not model_path:
+    raise ValueError("model_path to a trained .pth file is required")
+
   model = None
 
   # load models
   if model_name == "resnet":
-    model = torchvision.models.resnet18(pretrained=True)
+    model = torchvision.models.resnet18(pretrained=False)
     # for param in model.parameters():
     #   param.requires_grad = False
     num_features = model.fc.in_features
     model.fc = nn.Linear(num_features, class_num)
 
   elif model_name == "vgg":
-    model = torchvision.models.vgg11(pretrained=True)
+    model = torchvision.models.vgg11(pretrained=False)
     num_features = model.classifier[-1].in_features
     model.classifier[-1] = nn.Linear(num_features, class_num)
 
   elif model_name == "inception":
-    model = torchvision.models.inception_v3(pretrained=True, aux_logits=False)
+    # pretrained=True implied transform_input=True, keep it that way. also
+    # skip the slow (scipy truncnorm) random init the state dict overwrites
+    model = torchvision.models.inception_v3(
+      pretrained=False,
+      aux_logits=False,
+      transform_input=True,
+      init_weights=False,
+    )
     num_features = model.fc.in_features
     model.fc = nn.Linear(num_features, class_num)
 
   elif model_name == "mobilenet":
-    model = torchvision.models.mobilenet_v2(pretrained=True)
+    model = torchvision.models.mobilenet_v2(pretrained=False)
     num_features = model.classifier[-1].in_features
     model.classifier[-1] = nn.Linear(num_features, class_num)
 
   else:
     raise NotImplementedError("Model not supported")
 
-  model.load_state_dict(torch.load(model_path))
+  model.load_state_dict(torch.load(model_path, map_location="cpu"))
   model.eval()
   return model
 
 
-def load_dataset(dataset_path=None, dataset_image_len=1, batch_size=4):
-  """ Load ImageNette dataset with 10 images each from 10 different classes. """
+class _CachedImageFolder(torchvision.datasets.ImageFolder):
+  """ ImageFolder that caches its scanned (path, class) list inside the root
+  directory, so repeated runs skip walking every class folder. """
+
+  cache_name = ".imagefolder_cache.json"
+
+  def make_dataset(self, directory, class_to_idx, *args, **kwargs):
+    cache_path = os.path.join(directory, self.cache_name)
+    # adding or removing images touches the class folders' mtime, which is
+    # enough for ImageNette's flat layout. the root is left out on purpose,
+    # writing the cache file into it would bump its mtime
+    mtime = max(
+      os.stat(os.path.join(directory, c)).st_mtime_ns for c in class_to_idx
+    )
+
+    try:
+      with open(cache_path, "r") as f:
+        cache = json.load(f)
+      if cache["mtime"] == mtime and cache["class_to_idx"] == class_to_idx:
+        return [
+          (os.path.join(directory, path), target)
+          for path, target in cache["samples"]
+        ]
+    except (OSError, ValueError, KeyError, TypeError):
+      pass
+
+    samples = super().make_dataset(directory, class_to_idx, *args, **kwargs)
+
+    # store paths relative to the root, the script may run from elsewhere
+    cache = {
+      "mtime": mtime,
+      "class_to_idx": class_to_idx,
+      "samples": [
+        (os.path.relpath(path, directory), target) for path, target in samples
+      ],
+    }
+    try:
+      with open(cache_path, "w") as f:
+        json.dump(cache, f)
+    except OSError:
+      pass
+
+    return samples
+
+
+def load_dataset(
+  dataset_path=None,
+  dataset_image_len=1,
+  batch_size=4,
+  num_workers=None,
+  tensor_transforms=False,
+):
+  """ Load ImageNette dataset with 10 images each from 10 different classes.
+
+  `tensor_transforms` resizes with torchvision's faster v2 tensor pipeline.
+  Its pixels differ from the default PIL pipeline by up to 1/255, which
+  shifts clean accuracies and newly generated adversaries, so results are
+  not comparable with runs that used the default.
+  """
 
   # resize image to size 213 * 213
-  transform = transforms.Compose(
-    [transforms.Resize((213, 213)), transforms.ToTensor()]
-  )
+  if tensor_transforms:
+    if v2 is None:
+      raise ImportError("tensor_transforms needs torchvision 0.16 or newer")
+    # tensor pipeline: resize the uint8 image, only then convert to float
+    transform = v2.Compose(
+      [
+        v2.PILToTensor(),
+        v2.Resize((213, 213), antialias=True),
+        v2.ToDtype(torch.float32, scale=True),
+      ]
+    )
+  else:
+    transform = transforms.Compose(
+      [transforms.Resize((213, 213)), transforms.ToTensor()]
+    )
 
-  class_start_indice = [indice * 360 for indice in range(0, dataset_image_len)]
-  images_in_class_indice = np.array(
-    [[j for j in range(k, k + dataset_image_len)] for k in class_start_indice]
-  ).flatten()
+  # first `dataset_image_len` images of each class, classes are 360 apart
+  class_start_indice = np.arange(dataset_image_len) * 360
+  images_in_class_indice = (
+    class_start_indice[:, None] + np.arange(dataset_image_len)[None, :]
+  ).ravel()
 
   # load dataset with validation images
-  dataset = torchvision.datasets.ImageFolder(
-    root=dataset_path, transform=transform
-  )
+  dataset = _CachedImageFolder(root=dataset_path, transform=transform)
 
   # 1. get 10 images from 10 classes for a total of 100 images, or ...
   dataset = torch.utils.data.Subset(dataset, images_in_class_indice)
@@ -88,7 +201,19 @@ def load_dataset(dataset_path=None, dataset_image_len=1, batch_size=4):
 
   # compose dataset into dataloader
   # (don't shuffle, no need to shuffle, we're not training.)
-  dataset_loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+  # decode images in background workers, which are kept alive between the
+  # repeated validate() passes (half the CPUs, at most 4, by default)
+  if num_workers is None:
+    num_workers = min(4, (os.cpu_count() or 1) // 2 or 1)
+  loader_kwargs = {}
+  if num_workers > 0 and _LOADER_HAS_PERSISTENT_WORKERS:
+    loader_kwargs = dict(persistent_workers=True, prefetch_factor=4)
+  dataset_loader = torch.utils.data.DataLoader(
+    dataset,
+    batch_size=batch_size,
+    num_workers=num_workers,
+    **loader_kwargs
+  )
   # get dataset size (length)
   dataset_size = len(dataset)
 
@@ -118,21 +243,25 @@ def validate(
 
   preds = []
   acc = 0.0
-  for i, (image, label) in enumerate(dl_iter):
-    # make a prediction on either original dataset or adversaries
-    if advs is None:
-      prob = fmodel.forward(image.numpy())
-    else:
-      prob = fmodel.forward(advs[i])
-
-    pred = np.argmax(prob, axis=-1)
-    preds.append(pred)
-
-    # calculate current accuracy
-    acc += np.sum(pred == label.numpy())
-    current_acc = acc * 100 / ((i + 1) * batch_size)
-    if not silent:
-      dl_iter.set_postfix(acc="{:.2f}%".format(current_acc))
+  # Foolbox 2's PyTorchModel.forward() runs the model with autograd enabled,
+  # no graph is needed to only make predictions
+  with _inference_mode():
+    for i, (image, label) in enumerate(dl_iter):
+      # make a prediction on either original dataset or adversaries
+      if advs is None:
+        prob = fmodel.forward(image.numpy())
+      else:
+        prob = fmodel.forward(advs[i])
+
+      pred = np.argmax(prob, axis=-1)
+      preds.append(pred)
+
+      # calculate current accuracy (refresh progress bar every 8 batches and
+      # on the last one, tqdm ignores updates once iteration has finished)
+      acc += int((pred == label.numpy()).sum())
+      if not silent and ((i & 7) == 0 or i == len(dl_iter) - 1):
+        current_acc = acc * 100 / ((i + 1) * batch_size)
+        dl_iter.set_postfix(acc="{:.2f}%".format(current_acc))
 
   acc = acc * 100 / dataset_size
   return acc
@@ -146,38 +275,52 @@ def notify(time_elapsed, notify_py="notify.py"):
   msg = "Time elapsed {:.2f}m {:.2f}s".format(
     time_elapsed // 60, time_elapsed % 60
   )
-  cmd = 'python {} -b "{}" -t "{}" -m "{}"'.format(notify_py, bitjs, title, msg)
-  stream = os.popen(cmd)
-  output = stream.read()
-  print("\n" + output)
+  cmd = ["python", notify_py, "-b", bitjs, "-t", title, "-m", msg]
+  # don't block on the notification being delivered, reap the process in a
+  # background thread instead. errors from the script still go to stderr
+  process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+  threading.Thread(target=process.wait, daemon=True).start()
 
 
 def scale_adv(advs, resize_scale, interpolation_method):
   """ Resize adversaries with 5 different methods using OpenCV. """
 
-  interpolation_methods = {
-    "INTER_NEAREST": cv2.INTER_NEAREST,
-    "INTER_LINEAR": cv2.INTER_LINEAR,
-    "INTER_AREA": cv2.INTER_AREA,
-    "INTER_CUBIC": cv2.INTER_CUBIC,
-    "INTER_LANCZOS4": cv2.INTER_LANCZOS4,
-  }
-  interpolation = interpolation_methods[interpolation_method]
+  interpolation = _INTERPOLATION_METHODS[interpolation_method]
   resized_advs = []
 
   # default adversaries are stored in 4 images each batch
   for adv_batch in advs:
-    resized_adv_batch = []
-    for adv in adv_batch:
-      resized_adv = cv2.resize(
-        np.moveaxis(adv, 0, 2),
+    # (B, C, H, W) -> (B, H, W, C), OpenCV resizes HWC images natively.
+    # materialize the contiguous copy once per batch, cv2.resize would
+    # otherwise silently copy every non-contiguous image view itself
+    adv_batch_hwc = np.ascontiguousarray(np.transpose(adv_batch, (0, 2, 3, 1)))
+    num, height, width, channels = adv_batch_hwc.shape
+
+    # OpenCV rounds the scaled size half to even, just like round()
+    resized_h = int(round(height * resize_scale))
+    resized_w = int(round(width * resize_scale))
+    resized_adv_batch = np.empty(
+      (num, channels, resized_h, resized_w), dtype=adv_batch_hwc.dtype
+    )
+    # scratch HWC buffer reused by every cv2.resize in this batch
+    resized_adv = np.empty(
+      (resized_h, resized_w, channels), dtype=adv_batch_hwc.dtype
+    )
+
+    # resizing stays with OpenCV (no custom kernel), the experiment measures
+    # OpenCV's own interpolation, e.g. INTER_LINEAR silently switches to
+    # INTER_AREA for exact ×0.5 downscales
+    for j, adv in enumerate(adv_batch_hwc):
+      cv2.resize(
+        adv,
         (0, 0),
+        dst=resized_adv,
         fx=resize_scale,
         fy=resize_scale,
         interpolation=interpolation,
       )
-      resized_adv_batch.append(np.moveaxis(resized_adv, 2, 0))
-    resized_advs.append(np.array(resized_adv_batch))
+      resized_adv_batch[j] = np.transpose(resized_adv, (2, 0, 1))
+    resized_advs.append(resized_adv_batch)
 
   # print(
   #   "Image scaling done! Resized advs using {} with a scale of {}.".format(